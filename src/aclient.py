@@ -0,0 +1,79 @@
+"""
+Async client for downloading many w3schools pages concurrently.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+import time
+from email.utils import parsedate_to_datetime
+
+import httpx
+
+from .base import RETRY, user_agent
+
+log = logging.getLogger("src.aclient")
+
+LIMITS = httpx.Limits(max_connections=20)
+
+
+def _retry_after(response: httpx.Response) -> float | None:
+    """Seconds to wait from the Retry-After header, either delta-seconds or an HTTP-date"""
+    retry_after = response.headers.get("Retry-After", "").strip()
+    if not retry_after:
+        return None
+    if retry_after.isdigit():
+        return float(retry_after)
+    try:
+        return max(parsedate_to_datetime(retry_after).timestamp() - time.time(), 0.0)
+    except (TypeError, ValueError):
+        return None
+
+
+async def _fetch(client: httpx.AsyncClient, url: str) -> str | None:
+    # same policy as the urllib3 `RETRY` used by the requests session: transport
+    # errors (connect/read/protocol) and 429/5xx are retried with backoff
+    for attempt in range(RETRY.total + 1):
+        delay = RETRY.backoff_factor * (2**attempt)
+        try:
+            response = await client.get(url)
+        except httpx.TransportError:
+            log.debug("request to %s failed", url, exc_info=True)
+        else:
+            log.debug(
+                "recived response from %s with status code %s",
+                url,
+                response.status_code,
+            )
+            if response.is_success:
+                return response.text
+
+            if response.status_code not in RETRY.status_forcelist:
+                break
+
+            retry_after = _retry_after(response)
+            if retry_after is not None:
+                delay = retry_after
+
+        if attempt == RETRY.total:
+            break
+
+        log.debug("retrying %s in %ss...", url, delay)
+        await asyncio.sleep(delay)
+
+    log.info("failed to get data from %s", url)
+    return None
+
+
+async def fetch_many(urls: list[str]) -> dict[str, str]:
+    """Download all the urls concurrently, failed urls are left out"""
+    transport = httpx.AsyncHTTPTransport(http2=True, limits=LIMITS)
+    async with httpx.AsyncClient(transport=transport, headers={"User-Agent": user_agent()}, timeout=3) as client:
+        texts = await asyncio.gather(*[_fetch(client, url) for url in urls])
+    return {url: text for url, text in zip(urls, texts) if text is not None}
+
+
+def fetch_many_sync(urls: list[str]) -> dict[str, str]:
+    """Blocking version of `fetch_many`, pass the result to `base.seed_pages` to reuse it in `Base`"""
+    return asyncio.run(fetch_many(urls))
@@ -4,59 +4,274 @@ Main module for the w3schools scraper, contains the Base class.
 
 from __future__ import annotations
 
+import functools
 import logging
+import re
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
 from typing import TYPE_CHECKING
 
 import requests
-from bs4 import BeautifulSoup
+from bs4 import BeautifulSoup, SoupStrainer
+from bs4.element import Comment, NavigableString
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 if TYPE_CHECKING:
+    from concurrent.futures import Future
     from typing import Literal
 
-    from bs4.element import NavigableString, Tag
-
-from html_to_json import convert_tables
+    from bs4.element import Tag
 
 from .endpoints import EXCLUDE_TOPICS
+from .endpoints import W3SchoolsCodeSelector as CodeSelector
 from .endpoints import W3SchoolsNavigator as Navigator
 
 try:
     import lxml  # type: ignore  # noqa: F401  # pylint: disable=unused-import
+except ImportError as e:
+    raise ImportError("lxml is required, install it with `pip install lxml`") from e
+
+HTML_PARSER = "lxml"
+
+# Enum attribute access is slow compared to a plain global, bind the values once
+_MAIN_TG = Navigator.MAIN_TG.value
+_MAIN = Navigator.MAIN.value
+_NEXT = Navigator.NEXT.value
+_PREVIOUS = Navigator.PREVIOUS.value
+_PANEL_INFO_TG = Navigator.PANEL_INFO_TG.value
+_PANEL_INFO = Navigator.PANEL_INFO.value
+_PARAGRAPHS_INTRO_TG = Navigator.PARAGRAPHS_INTRO_TG.value
+_PARAGRAPHS_INTRO = Navigator.PARAGRAPHS_INTRO.value
+_CODE_TG = CodeSelector.GENERAL_TG.value
+_CODE = CodeSelector.GENERAL.value
+
+_MAIN_FILTER = {"class": _MAIN}
+_PANEL_INFO_FILTER = {"class": _PANEL_INFO}
+_PARAGRAPHS_INTRO_FILTER = {"class": _PARAGRAPHS_INTRO}
+_CODE_FILTER = {"class": _CODE}
+_NEXT_CLS = frozenset(_NEXT.split())
+_PREVIOUS_CLS = frozenset(_PREVIOUS.split())
+
+# Only the main div is ever used, so don't build a tree for the rest of the page.
+# While parsing, the strainer sees the raw class string (e.g. "w3-main w3-light-grey"),
+# so match the class token instead of the whole attribute.
+MAIN_STRAINER = SoupStrainer(_MAIN_TG, {"class": lambda c: c is not None and _MAIN in c.split()})
+
+USER_AGENT_FILE = Path(__file__).resolve().parent.parent / "user-agent.txt"
+
+# Retries (with backoff and Retry-After) are handled by urllib3
+RETRY = Retry(
+    total=5,
+    backoff_factor=0.3,
+    status_forcelist=(429, 500, 502, 503, 504),
+    allowed_methods=frozenset(["GET"]),
+)
+
+# With `Base(prefetch=True)` the pages following the current one are downloaded
+# in the background, so `paginate_next` usually finds them already in the cache.
+EXECUTOR = ThreadPoolExecutor(max_workers=5)
+PREFETCH_HOPS = 3
+
+log = logging.getLogger("src.base")
 
-    HTML_PARSER = "lxml"
-except ImportError:
-    HTML_PARSER = "html.parser"
+_BR_RE = re.compile(r"<br/?>")
 
-with open("user-agent.txt", "r") as file:
-    USER_AGENT = file.read()
+_CLEAR = frozenset({"w3-clear"})
+_PANEL = frozenset({"w3-panel"})
+_EXAMPLE = frozenset({"w3-example"})
 
-HEADERS = {
-    "User-Agent": USER_AGENT,
-}
 
-log = logging.getLogger("src.base")
+def _find_button_endpoints(main_div: Tag) -> tuple[str | None, str | None]:
+    """Get the hrefs of the next and previous buttons inside main_div"""
+    next_href = prev_href = None
+    for anchor in main_div.select("a.w3-btn"):
+        cls = frozenset(anchor.get("class") or ())
+        if next_href is None and cls >= _NEXT_CLS and "Next" in anchor.text:
+            next_href = anchor.get("href")
+        elif prev_href is None and cls >= _PREVIOUS_CLS and "Previous" in anchor.text:
+            prev_href = anchor.get("href")
+    return next_href, prev_href  # type: ignore
+
+
+def _code_text(code: Tag) -> str:
+    """Get the text of a code block, with <br/> tags as newlines"""
+    parts = []
+    for node in code.descendants:
+        if isinstance(node, NavigableString):
+            if not isinstance(node, Comment):
+                parts.append(str(node))
+        elif node.name == "br":
+            parts.append("\n")
+    return "".join(parts)
+
+
+def _table_to_json(table: Tag) -> list | dict:
+    """Convert the table to json, same layout as `html_to_json.convert_tables`"""
+    rows = table.find_all("tr")
+    if not rows:
+        return []
+
+    keys = [th.text for th in rows[0].find_all("th")]
+    if len(keys) == 1 and len(rows) > 1 and len(rows[1].find_all("th")) == 1:
+        # headers in the first column
+        data = {}
+        for row in rows:
+            th, td = row.find("th"), row.find("td")
+            if th is not None and td is not None:
+                data[th.text] = td.text
+        return data
+
+    if keys:
+        # headers across the top row
+        return [{key: td.text for key, td in zip(keys, row.find_all("td"))} for row in rows[1:]]
+
+    return [[td.text for td in row.find_all("td")] for row in rows]
+
+
+def _list_items(tag: Tag) -> list[str]:
+    """Get the text of every <li> in the list, in a single walk"""
+    items: list[list[str]] = []
+    for node in tag.descendants:
+        if isinstance(node, NavigableString):
+            if items and not isinstance(node, Comment):
+                items[-1].append(str(node))
+        elif node.name == "li":
+            items.append([])
+    return ["".join(parts) for parts in items]
+
+
+@functools.cache
+def user_agent() -> str:
+    """Read the User-Agent from user-agent.txt, only once and only when needed"""
+    return USER_AGENT_FILE.read_text(encoding="utf-8").strip()
+
+
+@functools.cache
+def _session() -> requests.Session:
+    # Shared session, so every page fetch reuses the same keep-alive connection
+    # instead of doing the DNS/TCP/TLS handshake again.
+    session = requests.Session()
+    session.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=20, max_retries=RETRY))
+    session.headers["User-Agent"] = user_agent()
+    return session
+
+
+@functools.cache
+def _imgkit():
+    # imgkit is only needed when rendering images, don't import it otherwise
+    import imgkit  # pylint: disable=import-outside-toplevel
+
+    return imgkit
+
+
+def _parse(text: str) -> tuple[BeautifulSoup, Tag]:
+    soup = BeautifulSoup(text, HTML_PARSER, parse_only=MAIN_STRAINER)
+    # W3Schools all main content lies in a div with class=w3-main
+    main_div: Tag | None = soup.find(_MAIN_TG, _MAIN_FILTER)  # type: ignore
+
+    if main_div is None:
+        log.error("failed to get main_div, recieved None instead")
+        raise RuntimeError("failed to find main div")
+
+    return soup, main_div
+
+
+# url -> html downloaded elsewhere, handed to `_fetch_and_parse` by `seed_pages`
+_SEEDED_PAGES: dict[str, str] = {}
+
+
+def seed_pages(pages: dict[str, str]) -> None:
+    """Add already downloaded pages (e.g. from `aclient.fetch_many_sync`) to the page cache"""
+    for url, text in pages.items():
+        _SEEDED_PAGES[url] = text
+        try:
+            # parses the seeded html on a cache miss, a cached url keeps its page
+            _fetch_and_parse(url)
+        finally:
+            _SEEDED_PAGES.pop(url, None)
+
+
+@functools.lru_cache(maxsize=512)
+def _fetch_and_parse(url: str) -> tuple[str, BeautifulSoup, Tag]:
+    """Download and parse the page, the result is shared by every Base instance"""
+    text = _SEEDED_PAGES.pop(url, None)
+    if text is None:
+        response = _session().get(url, timeout=3)
+        if log.isEnabledFor(logging.DEBUG):
+            log.debug(
+                "recived response from %s with status code %s",
+                url,
+                response.status_code,
+            )
+        response.raise_for_status()
+        text = response.text
+    return (text, *_parse(text))
+
+
+class PendingPage:
+    """A page which is being downloaded in the background"""
+
+    __slots__ = ("future",)
+
+    def __init__(self, future: Future[None]) -> None:
+        self.future = future
+
+    def result(self) -> None:
+        """Wait for the download to finish"""
+        self.future.result()
 
 
 class Base:
     """Base class for the w3schools scraper"""
 
+    __slots__ = (
+        "_url",
+        "url",
+        "render_images",
+        "prefetch",
+        "pages",
+        "page",
+        "soup",
+        "main_div",
+        "_next_href",
+        "_prev_href",
+        "__counter",
+    )
+
     soup: BeautifulSoup
     main_div: Tag | NavigableString | None  # type: ignore
 
     def __init__(
         self,
         url: str,
+        *,
+        render_images: bool = False,
+        prefetch: bool = False,
+        prefetched_text: str | None = None,
     ) -> None:
         self._url = url
+        self.render_images = render_images
+        # download the following pages in the background, meant for paginating
+        self.prefetch = prefetch
         self.url = url
-        self.pages: dict[str, BeautifulSoup] = {}
-        self.page = self.download_page()
+        # pages being prefetched in the background, the parsed pages themselves
+        # live in the `_fetch_and_parse` cache which is shared by all instances
+        self.pages: dict[str, PendingPage] = {}
+        self._next_href: str | None = None
+        self._prev_href: str | None = None
+        # html fetched elsewhere (e.g. `aclient.fetch_many_sync`) goes to the page
+        # cache as is, the following pages are not prefetched either
+        if prefetched_text is None:
+            self.page = self.download_page()
+        else:
+            seed_pages({url: prefetched_text})
+            self.page = self._download_page(prefetch=False)
         self.__counter = 0
 
     def __string_parse(self, string: str) -> str:
         """Parse the string to be used as filename"""
-        string = string.strip()
-        return string.replace("<br>", "\n").replace("<br/>", "\n")
+        return _BR_RE.sub("\n", string.strip())
 
     def to_file(
         self,
@@ -72,13 +287,14 @@ class Base:
         with open(filename, "w+", encoding="utf-8") as file:
             file.write(soup.prettify() if full else self.main_div.prettify())  # type: ignore
 
-    def to_image(self, soup: BeautifulSoup | None, *, filename: str) -> str:
-        import imgkit
+    def to_image(self, soup: BeautifulSoup | Tag | None, *, filename: str = "") -> str:
+        """Render the html to an image, returns the filename"""
+        imgkit = _imgkit()
 
         if soup is None:
             soup = self.soup
         try:
-            filename = filename or f"/files/{soup.name}.{' '.join(soup['class'])}{self.__counter}.jpg"
+            filename = filename or f"/files/{soup.name}.{' '.join(soup.get('class') or ())}{self.__counter}.jpg"
             imgkit.from_string(
                 soup.prettify(),
                 filename,
@@ -97,65 +313,53 @@ class Base:
 
     def download_page(self) -> str:
         """Download the page from the url"""
-        try:
-            self.soup = self.pages[self.url]
-            log.debug("recieved page from cache")
-            return self.soup.prettify()
-        except KeyError:
-            log.debug("page not in cache, downloading...")
-            return self._download_page()
-
-    def _download_page(self) -> str:
-        retry = 5
-        while retry:
+        pending = self.pages.pop(self.url, None)
+        if pending is not None:
+            log.debug("waiting for prefetched page...")
             try:
-                response = requests.get(self.url, timeout=3, headers=HEADERS)
-            except (requests.ReadTimeout, requests.ConnectionError):
-                log.debug("request timed out, retrying...")
-                retry -= 1
-                continue
-            log.debug(
-                "recived response from %s with status code %s",
-                self.url,
-                response.status_code,
-            )
-            if response.ok:
-                self.soup: BeautifulSoup = BeautifulSoup(response.text, HTML_PARSER)
-                # W3Schools all main content lies in a div with class=w3-main
-                self.main_div: Tag = self.soup.find(Navigator.MAIN_TG.value, {"class": Navigator.MAIN.value})  # type: ignore
-
-                if self.main_div is None:
-                    log.error("failed to get main_div, recieved None instead")
-                    raise RuntimeError("failed to find main div")
+                pending.result()
+            except Exception:  # pylint: disable=broad-except
+                # prefetching is only an optimisation, download the page normally
+                log.debug("prefetch of %s failed, downloading...", self.url, exc_info=True)
+        return self._download_page()
+
+    def _prefetch_page(self, url: str, hops: int) -> None:
+        # runs in EXECUTOR, keeps the prefetch chain going for `hops` more pages
+        try:
+            _, _, main_div = _fetch_and_parse(url)
+        except (requests.RequestException, RuntimeError):
+            log.debug("failed to prefetch %s", url, exc_info=True)
+            return
 
-                self.pages[self.url] = self.soup
+        endpoint, _ = _find_button_endpoints(main_div)
+        self._prefetch(f"{self._url}{endpoint}" if endpoint is not None else None, hops)
 
-                return response.text
+    def _prefetch(self, url: str | None, hops: int) -> None:
+        if not self.prefetch or url is None or not hops or url in self.pages:
+            return
+        log.debug("prefetching %s", url)
+        self.pages[url] = PendingPage(EXECUTOR.submit(self._prefetch_page, url, hops - 1))
 
-            log.debug("failed getting proper response, retrying...")
-            retry -= 1
+    def _download_page(self, *, prefetch: bool = True) -> str:
+        try:
+            text, self.soup, self.main_div = _fetch_and_parse(self.url)
+        except requests.RequestException:
+            log.info("failed to get data from %s returning `<html></html>`", self.url)
+            return "<html></html>"
 
-        log.info("failed to get data from %s returning `<html></html>`", self.url)
+        self._next_href, self._prev_href = _find_button_endpoints(self.main_div)  # type: ignore
+        if prefetch:
+            self._prefetch(self.get_next_button_url(), PREFETCH_HOPS)
 
-        return "<html></html>"
+        return text
 
     def get_next_button_url(self) -> str | None:
         """Get the url of the next button"""
-        endpoint = self._get_button_endpoint(Navigator.NEXT.value, "Next")
-        return f"{self._url}{endpoint}" if endpoint is not None else None
+        return f"{self._url}{self._next_href}" if self._next_href is not None else None
 
     def get_previous_button_url(self) -> str | None:
         """Get the url of the previous button"""
-        endpoint = self._get_button_endpoint(Navigator.PREVIOUS.value, "Previous")
-        return f"{self._url}{endpoint}" if endpoint is not None else None
-
-    def _get_button_endpoint(self, finder: str, button_name: str) -> str | None:
-        # sourcery skip: assign-if-exp, reintroduce-else
-        to_find = {"class": finder}
-        anchor: Tag | NavigableString | None = self.main_div.find("a", to_find)
-        if anchor is not None and button_name in anchor.text:
-            return anchor["href"]  # type: ignore
-        return None
+        return f"{self._url}{self._prev_href}" if self._prev_href is not None else None
 
     def paginate_next(self) -> None:
         """Paginate to the next page"""
@@ -176,16 +380,11 @@ class Base:
 
     def get_intro_panel(self) -> Tag | NavigableString | None:
         """Get the intro panel"""
-        return self.main_div.find(
-            Navigator.PANEL_INFO_TG.value, {"class": Navigator.PANEL_INFO.value}
-        )
+        return self.main_div.find(_PANEL_INFO_TG, _PANEL_INFO_FILTER)
 
     def get_paragraph_intros(self) -> list[Tag | NavigableString]:
         """Get the intros"""
-        return self.main_div.find_all(
-            Navigator.PARAGRAPHS_INTRO_TG.value,
-            {"class": Navigator.PARAGRAPHS_INTRO.value},
-        )
+        return self.main_div.find_all(_PARAGRAPHS_INTRO_TG, _PARAGRAPHS_INTRO_FILTER)
 
     def get_headers(self) -> list[Tag | NavigableString]:
         """Get the headers"""
@@ -208,20 +407,23 @@ class Base:
         self, header: Tag | NavigableString
     ) -> list[Tag | NavigableString]:
         """Get the siblings of the header"""
+        # single pass over next_siblings, instead of one find_next_sibling() per tag
         siblings = []
-        sib = self.get_h2_sibling(header)
-        while sib is not None:
+        for sib in header.next_siblings:
+            if sib.name is None:  # text/comment nodes
+                continue
+            if sib.name == "hr":
+                break
             siblings.append(sib)
-            sib = self.get_h2_sibling(sib)
         return siblings
 
     def get_topic(self, header: Tag | NavigableString) -> dict:
         """Get the topic"""
-        siblings = self._get_all_h2_siblings(header)
-
         if header.text in EXCLUDE_TOPICS:
             return {}
 
+        siblings = self._get_all_h2_siblings(header)
+
         payload = {"header": header.text, "rest": []}
         for sibling in siblings:
             _payload = {"text": "", "type": ""}
@@ -230,45 +432,43 @@ class Base:
             if sibling.name == "p":
                 _payload["text"] = self.__string_parse(sibling.text)
                 _payload["type"] = "p"
-                if sibling.find("img") is not None and sibling.find("img").has_attr("src"):  # type: ignore
+                img = sibling.find("img")
+                if img is not None and img.has_attr("src"):  # type: ignore
                     if not sibling.text:
-                        _payload["url"] = self._url + sibling.find("img")["src"]  # type: ignore
+                        _payload["url"] = self._url + img["src"]  # type: ignore
                     _payload["type"] = "img"
 
-            elif sibling.name == "ul":
-                st = "".join("\n" + self.__string_parse(li.text) for li in sibling.find_all("li"))  # type: ignore
-                _payload["text"] = st
-                _payload["type"] = "ul"
-
-            elif sibling.name == "ol":
-                st = "".join("\n" + self.__string_parse(li.text) for li in sibling.find_all("li"))  # type: ignore
-                _payload["text"] = st
-                _payload["type"] = "ol"
+            elif sibling.name in ("ul", "ol"):
+                _payload["text"] = "".join("\n" + self.__string_parse(item) for item in _list_items(sibling))  # type: ignore
+                _payload["type"] = sibling.name
 
             elif sibling.name == "div":
-                if sibling.has_attr("class") and "w3-clear" in sibling["class"]:  # type: ignore
+                cls = frozenset(sibling.get("class") or ())  # type: ignore
+                if cls & _CLEAR:
                     continue
 
-                if sibling.has_attr("class") and "w3-panel" in sibling["class"]:  # type: ignore
+                if cls & _PANEL:
                     _payload["text"] = self.__string_parse(sibling.text)
                     _payload["type"] = "panel"
 
-                elif sibling.has_attr("class") and "w3-example" in sibling["class"]:  # type: ignore
-                    internal_sibling = sibling.find("div", {"class": "w3-code"})  # type: ignore
+                elif cls & _EXAMPLE:
+                    internal_sibling = sibling.find(_CODE_TG, _CODE_FILTER)  # type: ignore
                     if internal_sibling is not None:
-                        _payload["text"] = self.__string_parse(BeautifulSoup(str(internal_sibling).replace("<br/>", "\n"), HTML_PARSER).text)  # type: ignore
-                        _payload["type"] = "code"
                         # I don't know why but the code blocks have <br/> tags instead of \n
+                        _payload["text"] = self.__string_parse(_code_text(internal_sibling))  # type: ignore
+                        _payload["type"] = "code"
 
-                elif not sibling.has_attr("class"):  # type: ignore
+                elif not cls:
                     _payload["text"] = str(sibling)
                     _payload["type"] = "div"
-                    _payload["file"] = self.to_image(sibling)  # type: ignore
+                    if self.render_images:
+                        _payload["file"] = self.to_image(sibling)  # type: ignore
 
             elif sibling.name == "table":
-                _payload["text"] = str(convert_tables(str(sibling))[0])
+                _payload["text"] = str(_table_to_json(sibling))  # type: ignore
                 _payload["type"] = "table"
 
             if _payload != _copy_payload:
                 payload["rest"].append(_payload)
+
         return payload
@@ -46,13 +46,13 @@ class W3SchoolsEndpoints(Enum):
         return self.value
 # fmt: on
 
-EXCLUDE_TOPICS = [
+EXCLUDE_TOPICS = frozenset({
     "Test Yourself With Exercises",
     "Exercise",
-    "Examples"
+    "Examples",
     "Report Error",
     "Thank You For Helping Us!",
-]
+})
 
 
 class W3SchoolsCodeSelector(Enum):